@@ -4,16 +4,25 @@
 # dialog for site visits, gallery, EMI calc, map pins (pydeck), quick chips,
 # lead CSV export, duplicate-safe keys, brand logo, real Instagram link.
 
+import csv
+import io
 import json
 import os
+import re
 import base64
 from pathlib import Path
 from datetime import datetime, time
 from urllib.parse import quote_plus
 
 import streamlit as st
-import pandas as pd
-import pydeck as pdk
+import numpy as np
+
+# Optional: orjson parses the catalog several times faster than the stdlib
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
 
 # --------------------------------------------------
 # Page / Theme
@@ -37,7 +46,7 @@ html, body, [class*="stApp"] { background: linear-gradient(135deg, #0b1020, var(
 .brand-card { padding: 12px; }
 
 /* Property hover */
-.property-card { transition: transform .18s ease, box-shadow .18s ease; }
+.property-card { transition: transform .18s ease, box-shadow .18s ease; padding: 10px; margin-bottom: 8px; }
 .property-card:hover { transform: translateY(-2px); box-shadow: 0 8px 24px rgba(0,0,0,.25); }
 
 .badge {
@@ -73,6 +82,8 @@ div[data-testid="stSlider"] .st-emotion-cache-1dp5vir { margin-top: 0; }
 .property-caption { margin-top: 6px; }
 .cta-row { margin-top: 8px; }
 img { border-radius: 12px; }
+.gallery summary { cursor: pointer; color: var(--muted); margin: 6px 0; }
+.gallery img { margin-bottom: 6px; }
 
 /* Sticky mobile action bar */
 .mobile-bar {
@@ -87,6 +98,9 @@ img { border-radius: 12px; }
 @media (max-width: 600px) { .filters { grid-template-columns: 1fr; } .hero { padding: 12px; } }
 </style>
 """
+# Minified once at import: the stylesheet must be re-emitted every rerun (elements not
+# re-sent are dropped from the page), so keep that per-rerun payload as small as possible
+CSS = re.sub(r"\s*([{};:,>])\s*", r"\1", re.sub(r"/\*.*?\*/|\s+", " ", CSS, flags=re.S)).strip()
 st.markdown(CSS, unsafe_allow_html=True)
 
 # --------------------------------------------------
@@ -97,8 +111,14 @@ PRASAD_IG_HANDLE = "prasad.realty_vizag"
 PRASAD_IG_URL = "https://www.instagram.com/prasad.realty_vizag?igsh=MWc3ZjN6dWwxNDNkZw=="
 PRASAD_PHONE = "+916309729493"
 PRASAD_WHATSAPP = "https://wa.me/916309729493"
+# Campaign tags appended to per-property WhatsApp links
+WA_UTM = "utm_source=streamlit&utm_medium=cta&utm_campaign=prasad_demo"
 # Path to your uploaded logo image (place it in your project)
 PRASAD_LOGO_PATH = "assets/prasad_logo.png"
+# Cards rendered per page in the listing grid
+PAGE_SIZE = 12
+# Above this many map points, individual pins give way to a hexagon aggregate layer
+MAP_PIN_LIMIT = 100
 
 # --------------------------------------------------
 # Helpers
@@ -108,15 +128,90 @@ def brand_logo_img(path: str, size: int = 64) -> str:
     Returns a circular <img> tag with base64-embedded logo.
     If the file is missing, returns an empty string gracefully.
     """
+    if not os.path.isfile(path):
+        return ""
+    return _logo_html(path, size, os.path.getmtime(path))
+
+@st.cache_resource(show_spinner=False)
+def _logo_html(path: str, size: int, mtime: float) -> str:
+    """
+    Reads and base64-encodes the logo once per (path, size, mtime).
+    cache_resource hands back the same string object, so there is no per-rerun copy of the payload.
+    """
     try:
-        if not os.path.isfile(path):
-            return ""
         with open(path, "rb") as f:
             b64 = base64.b64encode(f.read()).decode("utf-8")
-        return f"data:image/png;base64,{b64}"
+        mime = "image/jpeg" if path.lower().endswith((".jpg", ".jpeg")) else "image/png"
+        return (f"<img class='brand-logo' src='data:{mime};base64,{b64}' "
+                f"width='{size}' height='{size}' alt='Prasad Realty'/>")
     except Exception:
         return ""
 
+def static_url(src: str) -> str:
+    """
+    Maps a project-relative `static/...` image path to the URL Streamlit's static
+    server exposes it at (`app/static/...`, see .streamlit/config.toml).
+    Remote and data URLs pass through unchanged.
+    """
+    if src.startswith("static/"):
+        return "app/" + src
+    return src
+
+def lazy_img(url: str) -> str:
+    """<img> tag the browser fetches and decodes lazily (no st.image round-trip through Python)."""
+    return f"<img src='{url}' loading='lazy' decoding='async' style='width:100%;border-radius:12px;'/>"
+
+# Leads are stored column-wise (field -> list) so the CSV export wraps the lists directly
+LEAD_FIELDS = ("ts", "property_id", "title", "region", "name", "phone", "email",
+               "visit_date", "visit_time", "note", "source")
+
+def add_lead(lead: dict):
+    """Appends one lead record to the columnar st.session_state.leads."""
+    for k in LEAD_FIELDS:
+        st.session_state.leads[k].append(lead.get(k))
+
+def _emi(principal, rate_pa, years):
+    """Monthly EMI on a reducing-balance loan; a 0% rate splits the principal evenly."""
+    n = years * 12
+    if n <= 0:
+        return 0.0
+    r = rate_pa / 1200.0
+    if r == 0.0:
+        return principal / n
+    f = (1 + r) ** n
+    return principal * r * f / (f - 1)
+
+@st.cache_resource(show_spinner=False)
+def _emi_kernel():
+    """
+    EMI function, JIT-compiled once per process if numba is installed.
+    The explicit signature compiles eagerly, so the first Details click is not cold.
+    """
+    try:
+        from numba import njit
+    except ImportError:
+        return _emi
+    return njit("f8(f8, f8, i8)", cache=True)(_emi)
+
+monthly_emi = _emi_kernel()
+
+def leads_csv() -> bytes:
+    """
+    CSV export of this session's leads, re-serialised only after a lead is added.
+    Leads are append-only, so the row count versions the cached bytes. The cache
+    lives in session_state, not st.cache_data, which is shared across sessions.
+    """
+    n = len(st.session_state.leads["ts"])
+    cached = st.session_state.get("leads_csv")
+    if cached is None or cached[0] != n:
+        buf = io.StringIO()
+        w = csv.writer(buf, lineterminator="\n")
+        w.writerow(LEAD_FIELDS)
+        w.writerows(zip(*(st.session_state.leads[k] for k in LEAD_FIELDS)))
+        cached = (n, buf.getvalue().encode("utf-8"))
+        st.session_state.leads_csv = cached
+    return cached[1]
+
 def toast_ok(msg: str):
     """Toast feedback (fallback to success for older versions)."""
     try:
@@ -124,67 +219,86 @@ def toast_ok(msg: str):
     except Exception:
         st.success(msg)
 
+# --------------------------------------------------
+# Static HTML blocks (inputs are all constants above)
+# --------------------------------------------------
+BRAND_CARD_HTML = f"""
+<div class='brand-card'>
+  <div class='flex'>
+    <div style='display:flex;align-items:center;gap:10px;'>
+      {brand_logo_img(PRASAD_LOGO_PATH, size=64)}
+      <div>
+        <div style='font-weight:700;'>Prasad Realty</div>
+        <div class='small'>Instagram: @{PRASAD_IG_HANDLE}</div>
+      </div>
+    </div>
+    <a href='{PRASAD_IG_URL}' target='_blank' class='badge'>Follow</a>
+  </div>
+  <div style='margin-top:6px;' class='small'>Call / WhatsApp: {PRASAD_PHONE}</div>
+</div>
+"""
+
+HERO_HTML = f"""
+<div class='hero'>
+  <div class='flex flex-wrap'>
+    <div>
+      <div style='font-weight:800;font-size:20px;'>Find your home in Vizag</div>
+      <div class='small'>Filter by area, price, and type. Book a site visit in one click.</div>
+    </div>
+    <a href='{PRASAD_WHATSAPP}' target='_blank' class='button-primary'>WhatsApp</a>
+  </div>
+</div>
+"""
+
+MOBILE_BAR_HTML = f"""
+<div class='mobile-bar'>
+  <a href='{PRASAD_WHATSAPP}' target='_blank' class='badge'>WhatsApp</a>
+  <a href='{PRASAD_IG_URL}' target='_blank' class='badge'>Instagram</a>
+</div>
+"""
+
 # --------------------------------------------------
 # Session defaults
 # --------------------------------------------------
 if "user" not in st.session_state: st.session_state.user = None
-if "rerun" not in st.session_state: st.session_state.rerun = False
-if "leads" not in st.session_state: st.session_state.leads = []
-if "favorites" not in st.session_state: st.session_state.favorites = set()
+if "leads" not in st.session_state: st.session_state.leads = {k: [] for k in LEAD_FIELDS}
 
 def _init_filters():
     defaults = {
         "s_region": "All", "s_condition": "All", "s_type": "All",
         "s_min_bed": 0, "s_price_min": 0, "s_price_max": 10_000_000,
-        "s_sort": "Newest", "s_search": ""
+        "s_sort": "Newest", "s_search": "", "s_fav_only": False,
+        "s_compact": False
     }
-    for k, v in defaults.items():
-        if k not in st.session_state: st.session_state[k] = v
+    missing = defaults.keys() - st.session_state.keys()
+    if missing: st.session_state.update({k: defaults[k] for k in missing})
 _init_filters()
 
 # --------------------------------------------------
 # Sidebar (brand + login)
 # --------------------------------------------------
+# Callbacks run before the script, so the rerun a click triggers already sees the new user
+def _sign_in():
+    name = st.session_state.login_name.strip()
+    if name: st.session_state.user = name
+
+def _sign_out():
+    st.session_state.user = None
+
 with st.sidebar:
     st.title("Prasad Realty")
     st.caption("Visakhapatnam · Residential & Plots")
 
     # Brand card with circular logo + Instagram link
-    st.markdown(
-        f"""
-        <div class='brand-card'>
-          <div class='flex'>
-            <div style='display:flex;align-items:center;gap:10px;'>
-              {brand_logo_img(PRASAD_LOGO_PATH, size=64)}
-              <div>
-                <div style='font-weight:700;'>Prasad Realty</div>
-                <div class='small'>Instagram: @{PRASAD_IG_HANDLE}</div>
-              </div>
-            </div>
-            {PRASAD_IG_URL}Follow</a>
-          </div>
-          <div style='margin-top:6px;' class='small'>Call / WhatsApp: {PRASAD_PHONE}</div>
-        </div>
-        """, unsafe_allow_html=True
-    )
+    st.markdown(BRAND_CARD_HTML, unsafe_allow_html=True)
 
     if st.session_state.user:
         st.success(f"Signed in as {st.session_state.user}")
-        if st.button("Sign out", key="signout"):
-            st.session_state.user = None
-            st.session_state.rerun = True
+        st.button("Sign out", key="signout", on_click=_sign_out)
     else:
-        name = st.text_input("Your name")
-        if st.button("Continue", key="login"):
-            if name.strip():
-                st.session_state.user = name.strip()
-                st.session_state.rerun = True
-            else:
-                st.error("Please enter a name")
-
-    if st.session_state.rerun:
-        st.session_state.rerun = False
-        st.rerun()
+        st.text_input("Your name", key="login_name")
+        if st.button("Continue", key="login", on_click=_sign_in):
+            st.error("Please enter a name")  # _sign_in left user unset
 
 if not st.session_state.user:
     st.info("Please login from the left sidebar to continue.")
@@ -213,125 +327,257 @@ FALLBACK = [
    "image":"https://picsum.photos/seed/mvp4/800/500","insta_url":"","lat":17.7387,"lng":83.3277,
    "images":["https://picsum.photos/seed/m4/800/500","https://picsum.photos/seed/m5/800/500"]}
 ]
-try:
-    with open(DATA_PATH, "r", encoding="utf-8") as f:
-        data = json.load(f)
-except Exception:
-    data = FALLBACK
 
-regions = sorted({p["region_key"] for p in data})
-prices = [p.get("price_inr", 0) for p in data]
-pmin_data = min(prices) if prices else 0
-pmax_data = max(prices) if prices else 0
+def _mtime(path: Path) -> float:
+    """File modification time, or 0.0 when the file is missing."""
+    try:
+        return path.stat().st_mtime
+    except OSError:
+        return 0.0
+
+FRAME_COLUMNS = ["id", "region_key", "condition", "home_type", "bedrooms",
+                 "price_inr", "area_sqft", "title", "address", "lat", "lng"]
+
+@st.cache_data(show_spinner=False)
+def load_properties(path: str, mtime: float):
+    """
+    Loads the catalog plus its derived metadata once per file version.
+    `mtime` is only part of the cache key, so editing the JSON busts the cache.
+    Returns (data, df, regions, conditions, home_types, pmin, pmax, max_beds);
+    `df` holds the filter and map columns, row-aligned with `data`.
+    """
+    try:
+        data = _json_loads(Path(path).read_bytes())
+    except Exception:
+        data = [dict(p) for p in FALLBACK]
+
+    # Static per-card HTML, formatted once per load instead of on every rerun
+    for row, p in enumerate(data):
+        p["image"] = static_url(p["image"])
+        if p.get("images"): p["images"] = [static_url(u) for u in p["images"]]
+        p["_details"] = {k: v for k, v in p.items() if k != "image"}
+        p["_row"] = row  # position in data / df, used to index the favorites mask
+        p["_price_html"] = f"<span class='price'>₹{p['price_inr']:,.0f}</span>"
+        p["_badges_html"] = (
+            f"<span class='badge'>{p['region_key']}</span>"
+            f"<span class='badge'>{p['condition']}</span>"
+            f"<span class='badge'>{p['home_type']}</span>"
+            f"<span class='badge'>{p.get('bedrooms',0)} BR</span>"
+            f"<span class='badge'>{p.get('area_sqft',0)} sqft</span>"
+        )
+        txt = quote_plus(f"Hi Prasad Realty, I'm interested in '{p['title']}' in {p['region_key']}.")
+        p["_wa_url"] = f"{PRASAD_WHATSAPP}?text={txt}&{WA_UTM}"
+        insta = p.get("insta_url", "")
+        insta_html = (f"<a href='{insta}' target='_blank' class='badge' title='View post'>Instagram</a>"
+                      if insta else "<span class='badge' style='opacity:.5;'>Instagram</span>")
+        # "Link" is a share link only: opening ?open=<id> always starts a new session (fresh sign-in)
+        p["_cta_html"] = (
+            f"<div class='cta-row'>{insta_html} "
+            f"<a href='?open={p['id']}' target='_blank' class='badge' title='Shareable link to this listing'>Link</a> "
+            f"<a href='{p['_wa_url']}' target='_blank' class='button-primary'>WhatsApp</a></div>"
+        )
+        pics = [p["image"]] + p.get("images", [])
+        p["_gallery_html"] = (
+            f"<details class='gallery'><summary>Gallery · {len(pics)} photo{'s' if len(pics) != 1 else ''}</summary>"
+            + "".join(lazy_img(u) for u in pics) + "</details>"
+        )
+        dists = "".join(f"<span class='badge'>{k}: {v}</span>" for k, v in p.get("distances", {}).items())
+        # Whole card body (thumbnail, title, price, badges, address) as one element
+        p["_card_html"] = (
+            f"<div class='card property-card'>{lazy_img(p['image'])}"
+            "<div class='property-caption'>"
+            f"<b>{p['title']}</b><br/>{p['_price_html']}"
+            f"<div>{p['_badges_html']}{dists}</div>"
+            f"<div class='small' title='Address'>{p.get('address', '')}</div>"
+            "</div></div>"
+        )
+
+    import pandas as pd  # deferred: only needed on a cache miss
+    df = pd.DataFrame(data, columns=FRAME_COLUMNS)
+    df[["bedrooms", "price_inr", "area_sqft"]] = df[["bedrooms", "price_inr", "area_sqft"]].fillna(0)
+    # Narrow numeric dtypes; selector columns compare on integer category codes
+    df = df.astype({"bedrooms": "int8", "area_sqft": "int32", "price_inr": "int64",
+                    "region_key": "category", "condition": "category", "home_type": "category"})
+    # Lowercased "title address" haystack for the search box, built once per load.
+    # Arrow-backed strings (pyarrow ships with streamlit) give vectorized str.contains kernels.
+    df["_search"] = (df["title"].fillna("") + " " + df["address"].fillna("")).str.lower().astype("string[pyarrow]")
+
+    # Facets from the typed columns (C-level reductions); categories are the sorted unique values
+    regions = df["region_key"].cat.categories.tolist()
+    conditions = df["condition"].cat.categories.tolist()
+    home_types = df["home_type"].cat.categories.tolist()
+    if len(df):
+        pmin, pmax = (int(v) for v in df["price_inr"].agg(["min", "max"]))
+        max_beds = int(df["bedrooms"].max())
+    else:
+        pmin = pmax = max_beds = 0
+    return data, df, regions, conditions, home_types, pmin, pmax, max_beds
+
+data, props_df, regions, conditions, home_types, pmin_data, pmax_data, max_beds_data = load_properties(
+    str(DATA_PATH), _mtime(DATA_PATH))
 
 # --------------------------------------------------
 # Hero + Mobile bar
 # --------------------------------------------------
-st.markdown(
-    """
-    <div class='hero'>
-      <div class='flex flex-wrap'>
-        <div>
-          <div style='font-weight:800;font-size:20px;'>Find your home in Vizag</div>
-          <div class='small'>Filter by area, price, and type. Book a site visit in one click.</div>
-        </div>
-        <a href='""" + PRASAD_WHATSAPP + """' target='_blank' class='button-primary'>WhatsApp</a>
-      </div>
-    </div>
-    """, unsafe_allow_html=True
-)
-
-st.markdown(
-    f"""
-    <div class='mobile-bar'>
-      {PRASAD_WHATSAPP}WhatsApp</a>
-      {PRASAD_IG_URL}Instagram</a>
-    </div>
-    """, unsafe_allow_html=True
-)
+st.markdown(HERO_HTML, unsafe_allow_html=True)
+st.markdown(MOBILE_BAR_HTML, unsafe_allow_html=True)
+
+# Favorites: one bool per catalog row, tied to the catalog version. When properties.json
+# changes, favorites carry over by property id rather than by row position.
+_catalog_version = _mtime(DATA_PATH)
+if st.session_state.get("fav_version") != _catalog_version:
+    ids = props_df["id"].to_numpy()
+    old = st.session_state.get("fav_mask")
+    fav_ids = st.session_state.fav_ids[old].tolist() if old is not None else []
+    st.session_state.fav_mask = np.isin(ids, fav_ids)
+    st.session_state.fav_ids = ids
+    st.session_state.fav_version = _catalog_version
 
 # --------------------------------------------------
-# Fragments: filters + grid
+# Filters + grid
 # --------------------------------------------------
-@st.fragment
+def _apply_chip():
+    # Quick chips are one-shot shortcuts: act on the pick, then clear it so it can be re-picked
+    chip = st.session_state.chip
+    if chip == "₹50–80L":
+        _set_filters(s_price_min=5_000_000, s_price_max=8_000_000)
+        toast_ok("Applied ₹50–80L budget")
+    elif chip == "Sea-facing":
+        toast_ok("Demo chip: add 'sea-facing' tag in properties.json to use")
+    elif chip == "Gated community":
+        toast_ok("Demo chip: add 'amenities': ['Gated'] in properties.json to use")
+    st.session_state.chip = None
+
+# Applied filter (s_*) -> form widget key holding the pending edit
+FILTER_WIDGETS = {
+    "s_region": "f_region", "s_condition": "f_condition", "s_type": "f_type",
+    "s_min_bed": "f_min_bed", "s_price_min": "f_budget", "s_price_max": "f_budget",
+    "s_sort": "f_sort", "s_search": "f_search",
+}
+
+def _set_filters(**applied):
+    """
+    Applies filters from outside the form (chips, deep links). The matching form widgets
+    are dropped so they re-seed from the new values instead of keeping a stale edit.
+    A new result set starts from its first page.
+    """
+    for k, v in applied.items():
+        st.session_state[k] = v
+        st.session_state.pop(FILTER_WIDGETS[k], None)
+    st.session_state.page = 0
+
+def _seed_filter_widgets():
+    """Form widgets start from the applied filters; after that their keys keep the user's edits."""
+    s = st.session_state
+    lo, hi = int(pmin_data), int(pmax_data or 10_000_000)
+    seeds = {
+        "f_region": s.s_region, "f_condition": s.s_condition, "f_type": s.s_type,
+        "f_min_bed": s.s_min_bed, "f_sort": s.s_sort, "f_search": s.s_search,
+        "f_budget": (min(max(int(s.s_price_min or lo), lo), hi), min(max(int(s.s_price_max or hi), lo), hi)),
+    }
+    for k, v in seeds.items():
+        if k not in s: s[k] = v
+
 def render_filters():
-    # Quick chips (demo shortcuts)
-    ch1, ch2, ch3, ch4 = st.columns(4)
+    # Quick chips (demo shortcuts) as a single segmented control
+    ch1, ch2 = st.columns([3, 1])
     with ch1:
-        if st.button("₹50–80L", key="chip_5080"):
-            st.session_state.s_price_min, st.session_state.s_price_max = 5_000_000, 8_000_000
-            toast_ok("Applied ₹50–80L budget")
+        st.segmented_control("Quick filters", ["₹50–80L", "Sea-facing", "Gated community"],
+                             key="chip", on_change=_apply_chip, label_visibility="collapsed")
     with ch2:
-        if st.button("Sea-facing", key="chip_sea"):
-            toast_ok("Demo chip: add 'sea-facing' tag in properties.json to use")
-    with ch3:
-        if st.button("Gated community", key="chip_gated"):
-            toast_ok("Demo chip: add 'amenities': ['Gated'] in properties.json to use")
-    with ch4:
-        st.caption(f"Favorites: {len(st.session_state.favorites)}")
-
-    # Filters grid
-    st.markdown("<div class='filters'>", unsafe_allow_html=True)
-    c1, c2, c3, c4, c5, c6 = st.columns(6)
-    with c1:
-        st.session_state.s_region = st.selectbox("Region", ["All"] + regions,
-                                                 index=(["All"] + regions).index(st.session_state.s_region))
-    with c2:
-        st.session_state.s_condition = st.selectbox("Condition", ["All", "New", "Old"],
-                                                    index=["All","New","Old"].index(st.session_state.s_condition))
-    with c3:
-        st.session_state.s_type = st.selectbox("Type", ["All", "Individual", "Apartment"],
-                                               index=["All","Individual","Apartment"].index(st.session_state.s_type))
-    with c4:
-        beds_opts = [0,1,2,3,4,5]
-        idx = beds_opts.index(st.session_state.s_min_bed) if st.session_state.s_min_bed in beds_opts else 0
-        st.session_state.s_min_bed = st.selectbox("Min bedrooms", beds_opts, index=idx)
-    with c5:
-        pmin = int(st.session_state.s_price_min) if st.session_state.s_price_min else int(pmin_data)
-        pmax = int(st.session_state.s_price_max) if st.session_state.s_price_max else int(pmax_data or 10_000_000)
-        st.session_state.s_price_min, st.session_state.s_price_max = st.slider(
-            "Budget (₹)", min_value=int(pmin_data), max_value=int(pmax_data or 10_000_000),
-            value=(pmin, pmax), step=500_000
-        )
-    with c6:
-        sort_opts = ["Newest", "Price ↑", "Price ↓", "Area ↑", "Area ↓"]
-        st.session_state.s_sort = st.selectbox("Sort", sort_opts, index=sort_opts.index(st.session_state.s_sort))
-    st.markdown("</div>", unsafe_allow_html=True)
+        st.caption(f"Favorites: {int(st.session_state.fav_mask.sum())}")
+        st.toggle("Favorites only", key="s_fav_only", on_change=_set_page, args=(0,))
+        st.toggle("Compact view", key="s_compact")
 
-    # Search
-    st.markdown("<div class='search-wrap'>", unsafe_allow_html=True)
-    st.session_state.s_search = st.text_input("Search (title/address)", value=st.session_state.s_search)
-    st.markdown("</div>", unsafe_allow_html=True)
-
-def _matches(p):
-    s = st.session_state
-    if s.s_region != "All" and p["region_key"] != s.s_region: return False
-    if s.s_condition != "All" and p["condition"] != s.s_condition: return False
-    if s.s_type != "All" and p["home_type"] != s.s_type: return False
-    if s.s_min_bed and p.get("bedrooms", 0) < s.s_min_bed: return False
-    if not (s.s_price_min <= p.get("price_inr", 0) <= s.s_price_max): return False
-    qlc = (s.s_search or "").lower()
-    if qlc and qlc not in (p.get("title","") + " " + p.get("address","")).lower(): return False
-    return True
-
-def _sorter_key(p):
+    # Filters grid, batched in a form: adjusting several widgets costs one rerun on Apply
     s = st.session_state
-    if s.s_sort == "Price ↑": return p.get("price_inr", 0)
-    if s.s_sort == "Price ↓": return -p.get("price_inr", 0)
-    if s.s_sort == "Area ↑": return p.get("area_sqft", 0)
-    if s.s_sort == "Area ↓": return -p.get("area_sqft", 0)
-    return -p.get("id", 0)  # Newest
+    # Selections no longer in the catalog fall back to 'All' (or 0 beds) in the applied filters too
+    stale = {k: "All" for k, values in (("s_region", regions), ("s_condition", conditions), ("s_type", home_types))
+             if s[k] != "All" and s[k] not in values}
+    if s.s_min_bed > max_beds_data: stale["s_min_bed"] = 0
+    if stale: _set_filters(**stale)
+    _seed_filter_widgets()
+    with st.form("filters", clear_on_submit=False, border=False):
+        st.markdown("<div class='filters'>", unsafe_allow_html=True)
+        c1, c2, c3, c4, c5, c6 = st.columns(6)
+        with c1:
+            st.selectbox("Region", ["All"] + regions, key="f_region")
+        with c2:
+            st.selectbox("Condition", ["All"] + conditions, key="f_condition")
+        with c3:
+            st.selectbox("Type", ["All"] + home_types, key="f_type")
+        with c4:
+            st.selectbox("Min bedrooms", list(range(max_beds_data + 1)), key="f_min_bed")
+        with c5:
+            st.slider("Budget (₹)", min_value=int(pmin_data), max_value=int(pmax_data or 10_000_000),
+                      step=500_000, key="f_budget")
+        with c6:
+            st.selectbox("Sort", list(SORT_COLUMNS), key="f_sort")
+        st.markdown("</div>", unsafe_allow_html=True)
+
+        # Search
+        st.markdown("<div class='search-wrap'>", unsafe_allow_html=True)
+        st.text_input("Search (title/address)", key="f_search")
+        st.markdown("</div>", unsafe_allow_html=True)
+        submitted = st.form_submit_button("Apply filters")
+
+    if submitted:
+        s.s_region, s.s_condition, s.s_type, s.s_min_bed = s.f_region, s.f_condition, s.f_type, s.f_min_bed
+        s.s_price_min, s.s_price_max = s.f_budget
+        s.s_sort, s.s_search = s.f_sort, s.f_search
+        s.page = 0  # new result set: back to its first page
+
+def _filter_mask(df, region, condition, home_type, min_bed, price_min, price_max, search):
+    """
+    Boolean mask over `df` rows matching the given filters.
+    Predicates run cheapest first; the substring search only scans rows still in the mask.
+    Multi-word searches match rows containing every term, in any order.
+    """
+    price = df["price_inr"].to_numpy()
+    mask = (price >= price_min) & (price <= price_max)
+    if min_bed: mask &= df["bedrooms"].to_numpy() >= min_bed
+    if region != "All": mask &= df["region_key"].eq(region).to_numpy()
+    if condition != "All": mask &= df["condition"].eq(condition).to_numpy()
+    if home_type != "All": mask &= df["home_type"].eq(home_type).to_numpy()
+    # Each term narrows the survivors, so later terms scan fewer rows
+    for term in (search or "").lower().split():
+        surv = np.flatnonzero(mask)
+        if not len(surv): break
+        hits = df["_search"].iloc[surv].str.contains(term, regex=False, na=False).to_numpy(dtype=bool)
+        mask[surv[~hits]] = False
+    return mask
+
+# Sort option -> (column, ascending)
+SORT_COLUMNS = {
+    "Newest": ("id", False),
+    "Price ↑": ("price_inr", True), "Price ↓": ("price_inr", False),
+    "Area ↑": ("area_sqft", True), "Area ↓": ("area_sqft", False),
+}
+
+@st.cache_data(show_spinner=False, max_entries=128)
+def filter_indices(_df, data_version: float, region, condition, home_type, min_bed,
+                   price_min, price_max, search, sort) -> list:
+    """
+    Row indices (into `data`) matching the filters, in the selected sort order.
+    Memoised per distinct filter tuple (LRU-bounded), so returning to an earlier combination is a lookup.
+    `_df` is not hashed; `data_version` (the catalog mtime) keys it instead.
+    """
+    mask = _filter_mask(_df, region, condition, home_type, min_bed, price_min, price_max, search)
+    col, asc = SORT_COLUMNS[sort]
+    return _df[mask].sort_values(col, ascending=asc, kind="stable").index.tolist()
 
 @st.dialog("Book a site visit", width="large")
 def book_visit_dialog(p):
+    # One shared set of form keys for whichever property is open, so session_state
+    # does not grow a widget set per property visited.
     st.markdown(f"**{p['title']}** · {p['region_key']}")
-    visit_date = st.date_input("Date", key=f"dlg_date_{p['id']}")
-    visit_time = st.time_input("Time", value=time(11,30), key=f"dlg_time_{p['id']}")
-    name = st.text_input("Your name", key=f"dlg_nm_{p['id']}")
-    phone = st.text_input("Phone", key=f"dlg_ph_{p['id']}")
-    email = st.text_input("Email", key=f"dlg_em_{p['id']}")
-    note = st.text_area("Note", key=f"dlg_nt_{p['id']}")
-    if st.button("Request visit", key=f"dlg_req_{p['id']}"):
+    visit_date = st.date_input("Date", key="date_open")
+    visit_time = st.time_input("Time", value=time(11,30), key="time_open")
+    name = st.text_input("Your name", key="nm_open")
+    phone = st.text_input("Phone", key="ph_open")
+    email = st.text_input("Email", key="em_open")
+    note = st.text_area("Note", key="nt_open")
+    if st.button("Request visit", key="req_open"):
         lead = {
             "ts": datetime.now().isoformat(timespec="seconds"),
             "property_id": p["id"], "title": p["title"], "region": p["region_key"],
@@ -339,124 +585,186 @@ def book_visit_dialog(p):
             "visit_date": str(visit_date), "visit_time": str(visit_time),
             "note": note.strip(), "source": "site_visit"
         }
-        st.session_state.leads.append(lead)
+        add_lead(lead)
         toast_ok("Visit requested (demo).")
         st.rerun()
 
+@st.cache_resource(show_spinner=False, max_entries=64)
+def build_map_deck(_map_df, data_version: float, rows_key: tuple):
+    """
+    pydeck Deck for the given map rows, reused while the filtered set is unchanged
+    (e.g. favorite clicks or paging). `_map_df` is not hashed; the catalog version
+    plus the row indices identify it. The Deck is treated as read-only once built.
+    """
+    import pydeck as pdk  # deferred: only sessions that actually show the map pay for it
+
+    if len(_map_df) > MAP_PIN_LIMIT:
+        # Aggregate on the GPU instead of drawing one pin per listing
+        layer = pdk.Layer(
+            "HexagonLayer", data=_map_df, get_position='[lon, lat]',
+            radius=200, elevation_scale=4, extruded=True, pickable=True
+        )
+        tooltip = {"text": "{elevationValue} listings"}
+    else:
+        layer = pdk.Layer(
+            "ScatterplotLayer", data=_map_df, get_position='[lon, lat]',
+            get_fill_color='[34, 211, 238, 160]', get_radius=60, pickable=True
+        )
+        tooltip = {"text": "{title} — ₹{price}"}
+    vs = pdk.ViewState(latitude=float(_map_df.lat.mean()), longitude=float(_map_df.lon.mean()), zoom=12)
+    return pdk.Deck(layers=[layer], initial_view_state=vs, tooltip=tooltip)
+
+def _set_page(n: int):
+    st.session_state.page = n
+
+def _toggle_fav(row: int):
+    st.session_state.fav_mask[row] = not st.session_state.fav_mask[row]
+
 @st.fragment
-def render_grid(props):
+def render_card(p):
+    """
+    One listing card. As its own fragment, Favorite clicks and EMI edits rerun only
+    this card, not the map and the rest of the page.
+    """
+    st.markdown(p["_card_html"], unsafe_allow_html=True)
+
+    # Gallery: collapsed <details> of lazy images, switching photos needs no rerun
+    st.markdown(p["_gallery_html"], unsafe_allow_html=True)
+
+    # CTAs: Instagram/share/WhatsApp are plain links; only Favorite needs a widget
+    st.markdown(p["_cta_html"], unsafe_allow_html=True)
+    # Flipped in the callback so the label is already current on this run
+    is_fav = bool(st.session_state.fav_mask[p["_row"]])
+    if st.button(("💙 Unfavorite" if is_fav else "❤️ Favorite"), key=f"fav_{p['id']}",
+                 on_click=_toggle_fav, args=(p["_row"],)):
+        toast_ok("Added to favorites" if is_fav else "Removed from favorites")
+
+    # Details: the expander tracks its open state (on_change="rerun"), so the EMI inputs and
+    # the Book visit button exist only while a card is open; collapsed cards register no widgets
+    details = st.expander("Details", expanded=str(p["id"]) == st.session_state.open_id,
+                          key=f"det_{p['id']}", on_change="rerun")
+    with details:
+        if details.open:
+            st.json(p["_details"])
+
+            # EMI calculator
+            st.markdown("**EMI Calculator**")
+            # Stacked inputs: no nested st.columns inside an already-narrow card column
+            loan_amt = st.number_input("Loan amount (₹)", value=float(p["price_inr"]),
+                                       min_value=0.0, step=100000.0, key=f"loan_{p['id']}")
+            rate = st.number_input("Interest (% p.a.)", value=8.5, min_value=0.0, step=0.1,
+                                   key=f"rate_{p['id']}")
+            years = st.number_input("Tenure (years)", value=20, min_value=1, step=1,
+                                    key=f"years_{p['id']}")
+            emi = monthly_emi(float(loan_amt), float(rate), int(years))
+            st.write(f"**Estimated EMI:** ₹{emi:,.0f} / month")
+
+            # Site-visit dialog
+            if st.button("Book visit", key=f"bk_{p['id']}"):
+                book_visit_dialog(p)
+
+def render_table(props, rows):
+    """
+    Compact view: every match in one client-side, virtualized table instead of
+    paged cards. Read-only; favorites are toggled from the card view.
+    """
+    table = rows[["title", "region_key", "home_type", "bedrooms", "area_sqft", "price_inr"]].assign(
+        image=[p["image"] for p in props],
+        favorite=st.session_state.fav_mask[[p["_row"] for p in props]],
+        insta_url=[p.get("insta_url") or None for p in props],
+        wa_url=[p["_wa_url"] for p in props],
+    )
+    st.dataframe(
+        table, hide_index=True, width="stretch",
+        column_order=["image", "favorite", "title", "region_key", "home_type", "bedrooms",
+                      "area_sqft", "price_inr", "insta_url", "wa_url"],
+        column_config={
+            "image": st.column_config.ImageColumn("Photo"),
+            "favorite": st.column_config.CheckboxColumn("❤️"),
+            "title": "Title",
+            "region_key": "Region",
+            "home_type": "Type",
+            "bedrooms": st.column_config.NumberColumn("BR"),
+            "area_sqft": st.column_config.NumberColumn("Area (sqft)"),
+            "price_inr": st.column_config.NumberColumn("Price", format="₹%d"),
+            "insta_url": st.column_config.LinkColumn("Instagram", display_text="View post"),
+            "wa_url": st.column_config.LinkColumn("WhatsApp", display_text="Chat"),
+        },
+    )
+
+@st.fragment
+def render_grid(props, rows):
+    """`props` are the filtered records; `rows` is the matching slice of the catalog frame."""
     if not props:
         st.warning("No properties match your filters.")
         return
 
-    # Map (if lat/lng present)
-    map_df = pd.DataFrame([
-        {"lat": p.get("lat"), "lon": p.get("lng"), "title": p["title"], "price": p["price_inr"]}
-        for p in props if p.get("lat") and p.get("lng")
-    ])
+    # Map (if lat/lng present); float32 coordinates halve the payload sent to deck.gl
+    has_pos = rows["lat"].notna() & rows["lng"].notna()
+    map_df = (rows.loc[has_pos, ["lat", "lng", "title", "price_inr"]]
+              .rename(columns={"lng": "lon", "price_inr": "price"})
+              .astype({"lat": "float32", "lon": "float32"}))
     if not map_df.empty:
         st.markdown("### Map view")
-        layer = pdk.Layer(
-            "ScatterplotLayer", data=map_df, get_position='[lon, lat]',
-            get_fill_color='[34, 211, 238, 160]', get_radius=60, pickable=True
-        )
-        vs = pdk.ViewState(latitude=float(map_df.lat.mean()), longitude=float(map_df.lon.mean()), zoom=12)
-        st.pydeck_chart(pdk.Deck(layers=[layer], initial_view_state=vs,
-                                 tooltip={"text": "{title} — ₹{price}"}))
+        st.pydeck_chart(build_map_deck(map_df, _mtime(DATA_PATH), tuple(map_df.index)))
+
+    if st.session_state.s_compact:
+        render_table(props, rows)
+        return
+
+    # Only one page of cards is rendered per rerun
+    n_pages = max(1, (len(props) + PAGE_SIZE - 1) // PAGE_SIZE)
+    if st.session_state.get("page", 0) >= n_pages: st.session_state.page = 0  # safety net: list shrank under the page
+    page = st.session_state.setdefault("page", 0)
+    page_items = props[page * PAGE_SIZE:(page + 1) * PAGE_SIZE]
+    if n_pages > 1:
+        pg1, pg2, pg3 = st.columns([1, 2, 1])
+        with pg1:
+            st.button("◀ Prev", key="page_prev", disabled=page == 0, on_click=_set_page, args=(page - 1,))
+        with pg2:
+            st.caption(f"Page {page + 1} of {n_pages} · {len(props)} properties")
+        with pg3:
+            st.button("Next ▶", key="page_next", disabled=page >= n_pages - 1, on_click=_set_page, args=(page + 1,))
 
     cols = st.columns(3)  # auto-stacks on small screens
-    for i, p in enumerate(props):
+    for i, p in enumerate(page_items):
         with cols[i % 3]:
-            st.container()
-            st.image(p["image"], use_column_width=True)
-            st.markdown(f"**{p['title']}**")
-            st.markdown(f"<span class='price'>₹{p['price_inr']:,.0f}</span>", unsafe_allow_html=True)
-            st.markdown(
-                f"<span class='badge'>{p['region_key']}</span>"
-                f"<span class='badge'>{p['condition']}</span>"
-                f"<span class='badge'>{p['home_type']}</span>"
-                f"<span class='badge'>{p.get('bedrooms',0)} BR</span>"
-                f"<span class='badge'>{p.get('area_sqft',0)} sqft</span>",
-                unsafe_allow_html=True
-            )
-
-            dists = p.get("distances", {})
-            if dists:
-                st.write(" ".join([f"<span class='badge'>{k}: {v}</span>" for k,v in dists.items()]),
-                         unsafe_allow_html=True)
-
-            st.caption(p.get("address", ""), help="Address")
-
-            # Gallery (simple "carousel")
-            pics = [p["image"]] + p.get("images", [])
-            if pics:
-                sel = st.selectbox("Gallery", options=range(len(pics)),
-                                   format_func=lambda idx: f"Photo {idx+1}", key=f"gal_{p['id']}")
-                st.image(pics[sel], use_column_width=True)
-
-            # CTAs (unique keys)
-            b1, b2, b3, b4 = st.columns(4)
-            with b1:
-                insta = p.get("insta_url", "")
-                if insta:
-                    st.link_button("Instagram", url=insta, help="View post")
-                else:
-                    st.button("Instagram", key=f"insta_disabled_{p['id']}", disabled=True)
-            with b2:
-                txt = quote_plus(f"Hi Prasad Realty, I'm interested in '{p['title']}' in {p['region_key']}.")
-                utm = "utm_source=streamlit&utm_medium=cta&utm_campaign=prasad_demo"
-                st.link_button("WhatsApp", url=f"{PRASAD_WHATSAPP}?text={txt}&{utm}")
-            with b3:
-                fav_key = f"fav_{p['id']}"
-                is_fav = p["id"] in st.session_state.favorites
-                if st.button(("💙 Unfavorite" if is_fav else "❤️ Favorite"), key=fav_key):
-                    if is_fav:
-                        st.session_state.favorites.remove(p["id"])
-                        toast_ok("Removed from favorites")
-                    else:
-                        st.session_state.favorites.add(p["id"])
-                        toast_ok("Added to favorites")
-            with b4:
-                if st.button("Details", key=f"d_{p['id']}"):
-                    st.session_state[f"show_{p['id']}"] = not st.session_state.get(f"show_{p['id']}", False)
-
-            # Details
-            if st.session_state.get(f"show_{p['id']}", False):
-                with st.expander("Details", expanded=True):
-                    st.write({k: v for k, v in p.items() if k != "image"})
-
-                    # EMI calculator
-                    st.markdown("**EMI Calculator**")
-                    emi1, emi2, emi3 = st.columns(3)
-                    with emi1:
-                        loan_amt = st.number_input("Loan amount (₹)", value=float(p["price_inr"]),
-                                                   min_value=0.0, step=100000.0, key=f"loan_{p['id']}")
-                    with emi2:
-                        rate = st.number_input("Interest (% p.a.)", value=8.5, min_value=0.0, step=0.1,
-                                               key=f"rate_{p['id']}")
-                    with emi3:
-                        years = st.number_input("Tenure (years)", value=20, min_value=1, step=1,
-                                                key=f"years_{p['id']}")
-                    r = (rate / 100.0) / 12.0
-                    n = int(years * 12)
-                    emi = 0 if n == 0 else loan_amt * r * ((1 + r)**n) / (((1 + r)**n) - 1)
-                    st.write(f"**Estimated EMI:** ₹{emi:,.0f} / month")
-
-                    # Site-visit dialog
-                    if st.button("Book visit", key=f"bk_{p['id']}"):
-                        book_visit_dialog(p)
-
-# Run the fragments
+            render_card(p)
+
+# Render filters, then the grid for the applied filters
+_s = st.session_state
+# Deep link (?open=<id>): read once per session and looked up in the full catalog. If the
+# applied filters hide that listing they are widened so it shows; its Details start open.
+open_row = None
+if "open_id" not in _s:
+    _s.open_id = st.query_params.get("open")
+    open_row = next((i for i, p in enumerate(data) if str(p["id"]) == _s.open_id), None)
+    if open_row is None and _s.open_id is not None:
+        st.warning(f"Listing {_s.open_id} from the link is no longer available.")
+    elif open_row is not None:
+        shown = _filter_mask(props_df.iloc[[open_row]], _s.s_region, _s.s_condition, _s.s_type,
+                             _s.s_min_bed, _s.s_price_min, _s.s_price_max, _s.s_search)[0]
+        if not shown or (_s.s_fav_only and not _s.fav_mask[open_row]):
+            _set_filters(s_region="All", s_condition="All", s_type="All", s_min_bed=0,
+                         s_price_min=int(pmin_data), s_price_max=int(pmax_data), s_search="")
+            _s.s_fav_only = False  # the toggle's key; safe to set before the toggle renders
+
 render_filters()
-filtered = sorted([p for p in data if _matches(p)], key=_sorter_key)
-render_grid(filtered)
+idx = filter_indices(
+    props_df, _mtime(DATA_PATH), _s.s_region, _s.s_condition, _s.s_type, _s.s_min_bed,
+    _s.s_price_min, _s.s_price_max, " ".join(_s.s_search.lower().split()), _s.s_sort)
+if _s.s_fav_only:
+    idx = [i for i in idx if _s.fav_mask[i]]
+filtered = [data[i] for i in idx]
+if open_row is not None: _s.page = idx.index(open_row) // PAGE_SIZE  # the linked card's page
+render_grid(filtered, props_df.iloc[idx])
 
 # --------------------------------------------------
 # Quick contact + CSV
 # --------------------------------------------------
 st.markdown("---")
 st.subheader("Quick contact")
-qc1qc1, qc2, qc3 = st.columns([2,2,3])
+qc1, qc2, qc3 = st.columns([2,2,3])
 with qc1: qn = st.text_input("Your name", key="qc_name")
 with qc2: qp = st.text_input("Phone", key="qc_phone")
 with qc3: qe = st.text_input("Email", key="qc_email")
@@ -471,13 +779,11 @@ with cc1:
             "name": qn.strip(), "phone": qp.strip(), "email": qe.strip(),
             "visit_date": "", "visit_time": "", "note": msg.strip(), "source": "contact_form"
         }
-        st.session_state.leads.append(lead)
+        add_lead(lead)
         toast_ok("Message saved (demo).")
 with cc2:
-    if st.session_state.leads:
-        df = pd.DataFrame(st.session_state.leads)
-        st.download_button("Download leads (CSV)",
-                           data=df.to_csv(index=False).encode("utf-8"),
+    if st.session_state.leads["ts"]:
+        st.download_button("Download leads (CSV)", data=leads_csv(),
                            file_name="leads.csv", mime="text/csv")
     else:
         st.button("Download leads (CSV)", key="dl_disabled", disabled=True)